@@ -11,7 +11,9 @@
 Scraping eBooks from Gutenbergs web site isn't allowed anymore.
 Instead, you look in http://www.gutenberg.org/MIRRORS.ALL for a mirror nearby you.
 You might want to choose a HTTP mirror because FTP mirrors are slow with urllib.urlretrieve (but FTP mirrors are OK if you can use wget).
-Choose a suitable mirror URL and put it in the MIRROR variable below.
+Choose a suitable mirror URL and put it in the MIRROR variable in constants.py.
+Downloads are spread over the MIRRORS pool: each file comes from the fastest healthy mirror,
+with retries and backoff when a mirror misbehaves (see mirrors.py).
 
 The program then fetches {MIRROR}/GUTINDEX.ZIP, which is the compressed book index.
 In this zip is a textfile called GUTINDEX.ALL, in it every eBook is listed starting on the beginning
@@ -71,6 +73,7 @@ import json
 import io
 import constants
 from utils import load_manifest, create_manifest, get_manifest_fpath
+from mirrors import MirrorPool, DOWNLOAD_ERRORS
 
 
 def zip_to_txt(s: str, append: str = "") -> str:
@@ -81,8 +84,8 @@ def zip_to_txt(s: str, append: str = "") -> str:
 
 def make_alt(s: str, alt: str, extension: str = ".txt"):
     s: Path = Path(s)
-    s = s.parent.as_posix() + "/" + s.stem
-    s = re.sub(r"-[80]", "", s)
+    # Only the filename: the directories may contain "-0" or "-8" as well.
+    s = s.parent.as_posix() + "/" + re.sub(r"-[80]", "", s.stem)
     s = re.sub(r"http:/+", "http://", s)
     return s + alt + extension
 
@@ -108,7 +111,7 @@ def older(a, b):
     return sta <= stb
 
 
-def fetch(mirrorurl, filename, outputfilename):
+def fetch(pool: MirrorPool, filename, outputfilename):
     """Fetch a file from a gutenberg mirror, if it hasn't been fetched earlier today."""
     mustdownload = False
     if os.path.exists(outputfilename):
@@ -127,33 +130,44 @@ def fetch(mirrorurl, filename, outputfilename):
         mustdownload = True
 
     if mustdownload:
-        url = mirrorurl + filename
         try:
-            urllib.request.urlretrieve(url, outputfilename)
-        except urllib.error.HTTPError as e:
+            pool.urlretrieve(filename, outputfilename)
+        except DOWNLOAD_ERRORS as e:
             print(e)
 
 
-def urlretrieve_try_alt(url: str, outputfilename: str):
+def urlretrieve_try_alt(pool: MirrorPool, path: str, outputfilename: str):
     outputfilename = Path(constants.HOME, constants.ZIPPED_FOLDER, outputfilename)
     try:
-        urllib.request.urlretrieve(url, outputfilename)
+        pool.urlretrieve(path, outputfilename)
     except urllib.error.HTTPError as e:
+        if e.code != 404:
+            print(f"{path}: {e}")
+            return
         success = False
-        print(f"404: {url} not found")
+        print(f"404: {path} not found")
 
         for append in constants.ALT:
-            url_txt = make_alt(url, append)
+            path_txt = make_alt(path, append)
             outputfilename_txt = make_alt(outputfilename, append)
             try:
-                urllib.request.urlretrieve(url_txt, outputfilename_txt)
+                pool.urlretrieve(path_txt, outputfilename_txt)
                 success = True
                 break
 
             except urllib.error.HTTPError as e:
-                print(f"404: {url_txt} not found")
+                if e.code != 404:
+                    print(f"{path_txt}: {e}")
+                    break
+                print(f"404: {path_txt} not found")
+            except DOWNLOAD_ERRORS as e:
+                print(f"{path_txt}: {e}")
+                break
         if success:
-            print(f"Found {url_txt}")
+            print(f"Found {path_txt}")
+    except DOWNLOAD_ERRORS as e:
+        # All mirrors kept failing, the book will be picked up by the next run.
+        print(f"{path}: {e}")
 
 
 def make_folders():
@@ -169,13 +183,15 @@ def make_folders():
         os.mkdir(constants.UNZIPPED_FOLDER)
 
 
-def parse_index(override_manifest: bool):
+def parse_index(override_manifest: bool = False, pool: MirrorPool = None):
     manifest = load_manifest()
     if manifest is not None and not override_manifest:
         ebooks, ebookslanguage, mirrordir, mirrorname = manifest
         return ebooks, ebookslanguage, mirrordir, mirrorname
+    if pool is None:
+        pool = MirrorPool(constants.MIRRORS)
     # Download the book index, and unzip it.
-    fetch(constants.MIRROR, "GUTINDEX.zip", f"{constants.INDEXES_FOLDER}/GUTINDEX.zip")
+    fetch(pool, "GUTINDEX.zip", f"{constants.INDEXES_FOLDER}/GUTINDEX.zip")
     if not os.path.exists(f"{constants.INDEXES_FOLDER}/GUTINDEX.ALL") or older(
         f"{constants.INDEXES_FOLDER}/GUTINDEX.ALL",
         f"{constants.INDEXES_FOLDER}/GUTINDEX.zip",
@@ -188,7 +204,7 @@ def parse_index(override_manifest: bool):
         print("No need to extract GUTINDEX.ALL")
 
     # Download the file index, and gunzip it.
-    fetch(constants.MIRROR, "ls-lR.gz", f"{constants.INDEXES_FOLDER}/ls-lR.gz")
+    fetch(pool, "ls-lR.gz", f"{constants.INDEXES_FOLDER}/ls-lR.gz")
     if not os.path.exists(f"{constants.INDEXES_FOLDER}/ls-lR") or older(
         f"{constants.INDEXES_FOLDER}/ls-lR", f"{constants.INDEXES_FOLDER}/ls-lR.gz"
     ):
@@ -295,7 +311,10 @@ def download_ebooks(
     mirrordir: dict,
     mirrorname: dict,
     print_report: bool = True,
+    pool: MirrorPool = None,
 ):
+    if pool is None:
+        pool = MirrorPool(constants.MIRRORS)
     for nr, title in ebooks.items():
         if not nr in ebookslanguage:
             ebookslanguage[nr] = constants.DEFAULT_LANGUAGE
@@ -324,7 +343,7 @@ def download_ebooks(
         filename = mirrorname.get(ebookno)
         if not filedir or not filename:
             continue
-        url = constants.MIRROR + filedir + "/" + filename
+        path = filedir + "/" + filename
 
         file_exists = file_exists_in_some_form(filename)
 
@@ -333,7 +352,8 @@ def download_ebooks(
         else:
             if not filename.startswith("0") and not file_exists:
                 print(f"({nr}/{n_ebooks}) downloading {filename}...")
-                urlretrieve_try_alt(url, filename)
+                urlretrieve_try_alt(pool, path, filename)
+    pool.print_report()
 
 
 def unzip_files():
@@ -373,7 +393,8 @@ def move_txt():
 
 if __name__ == "__main__":
     make_folders()
-    ebooks, ebookslanguage, mirrordir, mirrorname = parse_index()
-    download_ebooks(ebooks, ebookslanguage, mirrordir, mirrorname, False)
+    pool = MirrorPool(constants.MIRRORS)
+    ebooks, ebookslanguage, mirrordir, mirrorname = parse_index(pool=pool)
+    download_ebooks(ebooks, ebookslanguage, mirrordir, mirrorname, False, pool)
     # unzip_files()
     move_txt()
@@ -3,6 +3,12 @@ from pathlib import Path
 
 # These parameters you can change yourself
 MIRROR = "http://www.mirrorservice.org/sites/ftp.ibiblio.org/pub/docs/books/gutenberg/"
+# Downloads go to the fastest healthy mirror of this pool, see mirrors.py.
+MIRRORS = [
+    MIRROR,
+    "https://gutenberg.pglaf.org/",
+    "http://aleph.gutenberg.org/",
+]
 # This is the language you want to scrape.
 LANGUAGE = "English"
 
@@ -15,6 +21,24 @@ EBOOKS_FOLDER = "ebooks"
 ZIPPED_FOLDER = "ebooks-zipped"
 UNZIPPED_FOLDER = "ebooks-unzipped"
 INDEXES_FOLDER = "indexes"
+EXPORT_FOLDER = "export"
+
+# Number of JSONL shards the library is exported to, see export.py.
+# Changing it reshuffles every book, so don't change it between resumed runs.
+EXPORT_SHARDS = 16
+# A shard is split into parts of about this many compressed bytes.
+EXPORT_PART_BYTES = 256 * 1024**2
+
+
+# Mirror pool tuning.
+MIRROR_TIMEOUT = 30  # seconds, per request
+MIRROR_RETRIES = 4  # rounds over the whole pool before giving up
+MIRROR_BACKOFF = 2.0  # seconds, doubled after every failed round
+MIRROR_MAX_FAILURES = 3  # consecutive failures before a mirror is benched
+MIRROR_COOLDOWN = 300  # seconds a benched mirror sits out
+MIRROR_PROBE_INTERVAL = 600  # seconds between two latency probes
+MIRROR_PROBE_PATH = "GUTINDEX.zip"
+MIRROR_PROBE_BYTES = 64 * 1024
 
 
 UNKNOWN_TITLE = "UNKNOWN_TITLE"
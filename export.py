@@ -0,0 +1,314 @@
+# export.py
+#
+# Exports the library in 'ebooks' to gzipped JSONL shards, for training datasets.
+
+"""
+Every book becomes one line of json: the header line written by dump_book_info,
+plus a "text" field with the rest of the book.
+
+    {"title": ..., "author": ..., "filename": ..., "bookno": ..., "text": ...}
+
+A book always lands in the same shard, shard_of(bookno) = crc32(bookno) % n_shards,
+so that exports of a growing library only differ by the new books.
+A shard is written as a series of fixed-size parts: once a part holds
+EXPORT_PART_BYTES compressed bytes (give or take the last book), the next book
+goes to a new part.
+
+    shard-00003-0000.jsonl.gz
+    shard-00003-0001.jsonl.gz
+    ...
+
+The library is scanned once, reading only the header line of every book, and
+the books are handed out to writer processes, each of which owns a few shards.
+The queues in between are bounded and the books are streamed line by line, so
+the size of the books and of the library don't add up in memory. The one thing
+that grows with the library is the set of booknos each writer keeps to skip
+the books already exported, a short string per book (a few MB for the whole
+of Gutenberg). Looking them up in the indexes on disk instead would cost a
+scan of the indexes for every book.
+
+Next to every part there is an index with one json line per book:
+
+    {"bookno": ..., "offset": ..., "length": ...}
+
+Each book is compressed as a separate gzip member, so a part is still a valid
+.jsonl.gz file, and a single book can be read back without decompressing the
+rest of the part, see read_book().
+
+Running the export again resumes it: parts are truncated to the last book found
+in their index, and the books already in there are skipped. This is also how a
+grown library is exported, only the new books are written.
+
+Usage:
+
+    python export.py [--output DIR] [--shards N] [--workers N] [--restart]
+"""
+
+
+import argparse
+import glob
+import gzip
+import io
+import json
+import multiprocessing
+import os
+import traceback
+import zlib
+from pathlib import Path
+import constants
+from utils import iter_ebooks
+
+
+EXPORT_MANIFEST_FILENAME = "export.json"
+
+# Books waiting for a writer, per writer.
+QUEUE_SIZE = 64
+
+
+def shard_of(bookno, n_shards: int) -> int:
+    # Not hash(): it is salted per process for strings.
+    return zlib.crc32(str(bookno).encode("utf8")) % n_shards
+
+
+def part_fpath(outputdir: str, shard: int, part: int) -> Path:
+    return Path(outputdir, f"shard-{shard:05d}-{part:04d}.jsonl.gz")
+
+
+def index_fpath(outputdir: str, shard: int, part: int) -> Path:
+    return Path(outputdir, f"shard-{shard:05d}-{part:04d}.idx.jsonl")
+
+
+def shard_parts(outputdir: str, shard: int) -> list:
+    """Part numbers of a shard found on disk, in order."""
+    parts = []
+    for fn in glob.glob(str(Path(outputdir, f"shard-{shard:05d}-*.idx.jsonl"))):
+        parts.append(int(Path(fn).name.split("-")[2].split(".")[0]))
+    return sorted(parts)
+
+
+def check_export_manifest(outputdir: str, n_shards: int):
+    """Refuse to resume an export which was made with another number of shards."""
+    manifest_fpath = Path(outputdir, EXPORT_MANIFEST_FILENAME)
+    if manifest_fpath.is_file():
+        jobj = json.loads(io.open(manifest_fpath, "r", encoding="utf8").read())
+        if jobj["shards"] != n_shards:
+            raise ValueError(
+                f"{outputdir} was exported to {jobj['shards']} shards, not {n_shards}. "
+                "Use --restart to start over."
+            )
+    with io.open(manifest_fpath, "w+", encoding="utf8") as f:
+        f.write(json.dumps({"shards": n_shards}, indent=4))
+
+
+def recover_part(outputdir: str, shard: int, part: int) -> set:
+    """Truncate a partially written part and its index to the last complete book.
+    Return the booknos which are already in the part."""
+    part_path = part_fpath(outputdir, shard, part)
+    index_path = index_fpath(outputdir, shard, part)
+    done = set()
+    part_end = 0
+    index_end = 0
+    part_size = os.path.getsize(part_path) if part_path.is_file() else 0
+    if index_path.is_file():
+        with open(index_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # Interrupted while writing this line.
+                entry = json.loads(line)
+                if entry["offset"] + entry["length"] > part_size:
+                    break
+                done.add(str(entry["bookno"]))
+                part_end = entry["offset"] + entry["length"]
+                index_end += len(line)
+    for path, end in ((part_path, part_end), (index_path, index_end)):
+        with open(path, "ab") as f:
+            f.truncate(end)
+    return done
+
+
+def write_book(partfile, fpath: Path) -> int:
+    """Append one book to the part as its own gzip member.
+    The book is streamed line by line into a json string, so it's never
+    held in memory as a whole. Return the compressed length."""
+    offset = partfile.tell()
+    with io.open(fpath, "r", encoding="utf8") as f:
+        info = json.loads(f.readline())
+        info.pop("text", None)
+        with gzip.GzipFile(fileobj=partfile, mode="wb", mtime=0) as gz:
+            head = json.dumps(info, ensure_ascii=False)
+            gz.write((head[:-1] + ', "text": "').encode("utf8"))
+            for line in f:
+                gz.write(json.dumps(line, ensure_ascii=False)[1:-1].encode("utf8"))
+            gz.write(b'"}\n')
+    return partfile.tell() - offset
+
+
+class ShardWriter:
+    """Appends books to the current part of a shard, starting a new part when it is full.
+    Keeps the booknos already in the shard in memory, see the module docstring."""
+
+    def __init__(self, outputdir: str, shard: int, part_bytes: int):
+        self.outputdir = outputdir
+        self.shard = shard
+        self.part_bytes = part_bytes
+        self.done = set()
+        self.added = 0
+        parts = shard_parts(outputdir, shard) or [0]
+        for part in parts:
+            self.done |= recover_part(outputdir, shard, part)
+        self.open_part(parts[-1])
+
+    def open_part(self, part: int):
+        self.part = part
+        self.partfile = open(part_fpath(self.outputdir, self.shard, part), "ab")
+        self.indexfile = open(index_fpath(self.outputdir, self.shard, part), "ab")
+
+    def close(self):
+        self.partfile.close()
+        self.indexfile.close()
+
+    def add(self, fpath: str, bookno):
+        bookno = str(bookno)
+        if bookno in self.done:
+            return
+        if self.partfile.tell() >= self.part_bytes:
+            self.close()
+            self.open_part(self.part + 1)
+        offset = self.partfile.tell()
+        length = write_book(self.partfile, fpath)
+        # The book must be on disk before the index says it is.
+        self.partfile.flush()
+        entry = {"bookno": bookno, "offset": offset, "length": length}
+        self.indexfile.write((json.dumps(entry) + "\n").encode("utf8"))
+        self.indexfile.flush()
+        self.done.add(bookno)
+        self.added += 1
+
+
+def writer_process(outputdir: str, shards: list, part_bytes: int, books, results):
+    """Write the books coming in through the books queue, until a None arrives.
+    Put {shard: books added} or the traceback of an error on the results queue."""
+    writers = {}
+    error = None
+    try:
+        for shard in shards:
+            writers[shard] = ShardWriter(outputdir, shard, part_bytes)
+    except Exception:
+        error = traceback.format_exc()
+    while True:
+        item = books.get()
+        if item is None:
+            break
+        if error is not None:
+            continue  # Keep draining, so that the scan doesn't block on a full queue.
+        shard, fpath, bookno = item
+        try:
+            writers[shard].add(fpath, bookno)
+        except Exception:
+            error = traceback.format_exc()
+    for writer in writers.values():
+        writer.close()
+    if error is not None:
+        results.put(error)
+    else:
+        results.put({shard: writer.added for shard, writer in writers.items()})
+
+
+def remove_export(outputdir: str):
+    """Remove every shard of a previous export, whatever its number of shards."""
+    for fn in glob.glob(str(Path(outputdir, "shard-*"))):
+        os.remove(fn)
+    manifest_fpath = Path(outputdir, EXPORT_MANIFEST_FILENAME)
+    if manifest_fpath.is_file():
+        os.remove(manifest_fpath)
+
+
+def export_library(
+    outputdir: str = constants.EXPORT_FOLDER,
+    n_shards: int = constants.EXPORT_SHARDS,
+    workers: int = None,
+    restart: bool = False,
+    part_bytes: int = constants.EXPORT_PART_BYTES,
+) -> int:
+    """Export the library, return the number of books added."""
+    outputdir = Path(constants.HOME, outputdir)
+    os.makedirs(outputdir, exist_ok=True)
+    if restart:
+        remove_export(outputdir)
+    check_export_manifest(outputdir, n_shards)
+
+    workers = min(workers or os.cpu_count() or 1, n_shards)
+    results = multiprocessing.Queue()
+    queues = []
+    processes = []
+    for worker in range(workers):
+        queue = multiprocessing.Queue(QUEUE_SIZE)
+        shards = list(range(worker, n_shards, workers))
+        process = multiprocessing.Process(
+            target=writer_process,
+            args=(str(outputdir), shards, part_bytes, queue, results),
+        )
+        process.start()
+        queues.append(queue)
+        processes.append(process)
+
+    try:
+        for fpath, info in iter_ebooks():
+            shard = shard_of(info["bookno"], n_shards)
+            queues[shard % workers].put((shard, str(fpath), info["bookno"]))
+    finally:
+        for queue in queues:
+            queue.put(None)
+
+    added = {}
+    errors = []
+    for _ in processes:
+        result = results.get()
+        if isinstance(result, str):
+            errors.append(result)
+        else:
+            added.update(result)
+    for process in processes:
+        process.join()
+    if errors:
+        raise RuntimeError("Export failed:\n" + "\n".join(errors))
+
+    for shard in sorted(added):
+        print(f"shard {shard}: {added[shard]} books added")
+    total = sum(added.values())
+    print(f"Exported {total} books to {outputdir}")
+    return total
+
+
+def read_book(
+    bookno,
+    outputdir: str = constants.EXPORT_FOLDER,
+    n_shards: int = constants.EXPORT_SHARDS,
+) -> dict:
+    """Random access to a single exported book, using the part indexes."""
+    outputdir = Path(constants.HOME, outputdir)
+    shard = shard_of(bookno, n_shards)
+    for part in shard_parts(outputdir, shard):
+        with open(index_fpath(outputdir, shard, part), "r", encoding="utf8") as f:
+            for line in f:
+                entry = json.loads(line)
+                if str(entry["bookno"]) == str(bookno):
+                    with open(part_fpath(outputdir, shard, part), "rb") as partfile:
+                        partfile.seek(entry["offset"])
+                        data = partfile.read(entry["length"])
+                    return json.loads(gzip.decompress(data))
+    return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export the ebooks library to gzipped JSONL shards."
+    )
+    parser.add_argument("--output", default=constants.EXPORT_FOLDER)
+    parser.add_argument("--shards", type=int, default=constants.EXPORT_SHARDS)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--restart", action="store_true", help="discard a previous export"
+    )
+    args = parser.parse_args()
+    export_library(args.output, args.shards, args.workers, args.restart)
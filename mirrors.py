@@ -0,0 +1,278 @@
+# mirrors.py
+#
+# A pool of Project Gutenberg mirrors. Every download goes to the fastest
+# healthy mirror, failing mirrors are retried with exponential backoff and
+# benched for a while when they keep failing.
+
+"""
+Usage:
+
+    pool = MirrorPool(constants.MIRRORS)
+    pool.urlretrieve("3/1/0/6/31060/31060-8.zip", "ebooks-zipped/31060-8.zip")
+    pool.print_report()
+
+Paths are relative to the mirror root. The mirrors are probed every
+MIRROR_PROBE_INTERVAL seconds by reading the first MIRROR_PROBE_BYTES of
+MIRROR_PROBE_PATH, which gives a latency (time to first byte) and a throughput.
+Actual downloads update the throughput as well.
+
+A 404 only means that this mirror doesn't have the file: the next mirror is
+asked, and if none of them serves the file while at least one answered 404, the
+HTTPError 404 is raised, so that callers can look for alternative filenames.
+Any other error, including a body shorter than its Content-Length, counts as a
+failure of the mirror. After MIRROR_MAX_FAILURES consecutive failures a mirror
+is benched for MIRROR_COOLDOWN seconds, after which it gets one more chance.
+Benched mirrors aren't probed.
+
+Probes are counted apart from downloads in the per-mirror report.
+"""
+
+
+import http.client
+import os
+import shutil
+import time
+import urllib.error
+import urllib.request
+import constants
+
+
+# Weight of a new measurement in the moving averages.
+SMOOTHING = 0.3
+
+# What a misbehaving mirror can throw at us.
+# http.client.HTTPException covers broken responses such as IncompleteRead.
+DOWNLOAD_ERRORS = (urllib.error.URLError, OSError, http.client.HTTPException)
+
+
+def smooth(old: float, new: float) -> float:
+    if old is None:
+        return new
+    return (1 - SMOOTHING) * old + SMOOTHING * new
+
+
+class MirrorStats:
+    """What we know about a single mirror."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.latency = None  # seconds, moving average
+        self.throughput = None  # bytes per second, moving average
+        self.successes = 0
+        self.failures = 0
+        self.probes = 0
+        self.probe_failures = 0
+        self.not_found = 0
+        self.consecutive_failures = 0
+        self.benched_until = 0.0
+        self.bytes_downloaded = 0
+        self.last_error = None
+
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.benched_until
+
+    def score(self) -> float:
+        """Estimated time to fetch a probe-sized chunk, lower is better."""
+        if self.latency is None:
+            return float("inf")
+        if not self.throughput:
+            return self.latency
+        return self.latency + constants.MIRROR_PROBE_BYTES / self.throughput
+
+    def as_dict(self) -> dict:
+        return {
+            "url": self.url,
+            "latency": self.latency,
+            "throughput": self.throughput,
+            "successes": self.successes,
+            "failures": self.failures,
+            "probes": self.probes,
+            "probe_failures": self.probe_failures,
+            "not_found": self.not_found,
+            "bytes_downloaded": self.bytes_downloaded,
+            "last_error": self.last_error,
+        }
+
+
+class MirrorPool:
+    def __init__(
+        self,
+        mirrors: list,
+        timeout: float = constants.MIRROR_TIMEOUT,
+        retries: int = constants.MIRROR_RETRIES,
+        backoff: float = constants.MIRROR_BACKOFF,
+        max_failures: int = constants.MIRROR_MAX_FAILURES,
+        cooldown: float = constants.MIRROR_COOLDOWN,
+        probe_interval: float = constants.MIRROR_PROBE_INTERVAL,
+        probe_path: str = constants.MIRROR_PROBE_PATH,
+        sleep=time.sleep,
+        clock=time.monotonic,
+    ):
+        if not mirrors:
+            raise ValueError("A mirror pool needs at least one mirror")
+        if retries < 1:
+            raise ValueError("A mirror pool needs at least one try per download")
+        self.stats = {}
+        for url in mirrors:
+            if not url.endswith("/"):
+                url += "/"
+            self.stats[url] = MirrorStats(url)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.probe_interval = probe_interval
+        self.probe_path = probe_path
+        self.sleep = sleep
+        self.clock = clock
+        self.last_probe = None
+
+    def record_throughput(self, stats: MirrorStats, nbytes: int, elapsed: float):
+        if nbytes and elapsed > 0:
+            stats.throughput = smooth(stats.throughput, nbytes / elapsed)
+
+    def record_success(self, stats: MirrorStats, nbytes: int, elapsed: float):
+        stats.successes += 1
+        stats.consecutive_failures = 0
+        stats.benched_until = 0.0
+        stats.bytes_downloaded += nbytes
+        self.record_throughput(stats, nbytes, elapsed)
+
+    def record_failure(self, stats: MirrorStats, error: Exception, probe=False):
+        if probe:
+            stats.probe_failures += 1
+        else:
+            stats.failures += 1
+        stats.consecutive_failures += 1
+        stats.last_error = str(error)
+        if stats.consecutive_failures >= self.max_failures:
+            stats.benched_until = self.clock() + self.cooldown
+            print(f"Mirror {stats.url} benched for {self.cooldown}s: {error}")
+
+    def probe(self, stats: MirrorStats) -> bool:
+        """Measure latency and throughput of a mirror. Return True on success."""
+        url = stats.url + self.probe_path
+        start = self.clock()
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                first = response.read(1)
+                latency = self.clock() - start
+                data = first + response.read(constants.MIRROR_PROBE_BYTES - 1)
+            elapsed = self.clock() - start
+        except DOWNLOAD_ERRORS as e:
+            self.record_failure(stats, e, probe=True)
+            return False
+        stats.probes += 1
+        stats.consecutive_failures = 0
+        stats.latency = smooth(stats.latency, latency)
+        self.record_throughput(stats, len(data), elapsed)
+        return True
+
+    def probe_all(self):
+        """Probe every mirror which isn't benched."""
+        now = self.clock()
+        for stats in self.stats.values():
+            if stats.is_healthy(now):
+                self.probe(stats)
+        self.last_probe = self.clock()
+
+    def maybe_probe(self):
+        if self.last_probe is None or (
+            self.clock() - self.last_probe >= self.probe_interval
+        ):
+            self.probe_all()
+
+    def ranked(self) -> list:
+        """Healthy mirrors, fastest first. Unprobed mirrors come last, in pool order."""
+        now = self.clock()
+        healthy = [s for s in self.stats.values() if s.is_healthy(now)]
+        return sorted(healthy, key=lambda s: s.score())
+
+    def download(self, stats: MirrorStats, path: str, outputfilename: str):
+        """Download a single file from a single mirror.
+        The file is written under a temporary name first, and checked against
+        the Content-Length, so that an interrupted download never looks like a
+        finished one."""
+        url = stats.url + path
+        partfilename = str(outputfilename) + ".part"
+        start = self.clock()
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                with open(partfilename, "wb") as f:
+                    shutil.copyfileobj(response, f)
+                expected = response.headers.get("Content-Length")
+            received = os.path.getsize(partfilename)
+            if expected is not None and received < int(expected):
+                # Same check, and same error, as urllib.request.urlretrieve.
+                raise urllib.error.ContentTooShortError(
+                    f"{url}: retrieval incomplete, got only {received} out of "
+                    f"{expected} bytes",
+                    None,
+                )
+            os.replace(partfilename, outputfilename)
+        finally:
+            if os.path.exists(partfilename):
+                os.remove(partfilename)
+        elapsed = self.clock() - start
+        self.record_success(stats, os.path.getsize(outputfilename), elapsed)
+
+    def urlretrieve(self, path: str, outputfilename: str):
+        """Download path, relative to the mirror root, into outputfilename.
+        Raises urllib.error.HTTPError 404 if no mirror has the file, and the last
+        error seen if all the retries failed."""
+        self.maybe_probe()
+        last_error = None
+        for attempt in range(self.retries):
+            if attempt > 0:
+                delay = self.backoff * 2 ** (attempt - 1)
+                print(f"All mirrors failed for {path}, retrying in {delay:.1f}s")
+                self.sleep(delay)
+            candidates = self.ranked()
+            if not candidates:
+                # Everybody is benched, give the least recently benched one a go.
+                candidates = sorted(
+                    self.stats.values(), key=lambda s: s.benched_until
+                )[:1]
+            not_found = None
+            round_error = None
+            for stats in candidates:
+                try:
+                    self.download(stats, path, outputfilename)
+                    return
+                except urllib.error.HTTPError as e:
+                    if e.code == 404:
+                        stats.not_found += 1
+                        not_found = e
+                        continue
+                    self.record_failure(stats, e)
+                    round_error = e
+                except DOWNLOAD_ERRORS as e:
+                    self.record_failure(stats, e)
+                    round_error = e
+            if not_found is not None:
+                # Nobody served the file and at least one mirror says it doesn't
+                # exist: let the caller look for another filename rather than
+                # retrying a mirror that is failing anyway.
+                raise not_found
+            last_error = round_error
+        raise last_error
+
+    def report(self) -> list:
+        return [stats.as_dict() for stats in self.stats.values()]
+
+    def print_report(self):
+        for stats in self.stats.values():
+            latency = "?" if stats.latency is None else f"{stats.latency * 1000:.0f} ms"
+            throughput = (
+                "?"
+                if stats.throughput is None
+                else f"{stats.throughput / 1024:.0f} kB/s"
+            )
+            print(
+                f"{stats.url}: {latency}, {throughput}, "
+                f"{stats.successes} ok, {stats.failures} failed, "
+                f"{stats.not_found} not found, "
+                f"{stats.probes} probes ({stats.probe_failures} failed), "
+                f"{stats.bytes_downloaded / (1024**2):.1f} MB"
+            )
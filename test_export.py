@@ -0,0 +1,126 @@
+import glob
+import gzip
+import json
+import os
+from pathlib import Path
+import pytest
+import constants
+import export
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, "HOME", tmp_path)
+    (tmp_path / constants.EBOOKS_FOLDER).mkdir()
+    return tmp_path
+
+
+def add_books(home: Path, booknos, subdir: str = ""):
+    folder = Path(home, constants.EBOOKS_FOLDER, subdir)
+    folder.mkdir(exist_ok=True)
+    for bookno in booknos:
+        info = {
+            "title": f"Title {bookno}",
+            "author": "Author",
+            "filename": f"{bookno}.txt",
+            "bookno": str(bookno),
+        }
+        with open(Path(folder, f"title_{bookno}.txt"), "w", encoding="utf8") as f:
+            f.write(json.dumps(info) + "\n")
+            f.write(book_text(bookno))
+
+
+def book_text(bookno) -> str:
+    return f'Chapter "{bookno}" é\\\n\nThe end of {bookno}.\n' * (int(bookno) + 1)
+
+
+def exported_booknos(outputdir: Path) -> list:
+    booknos = []
+    for fn in glob.glob(str(Path(outputdir, "shard-*.jsonl.gz"))):
+        with gzip.open(fn, "rt", encoding="utf8") as f:
+            booknos += [json.loads(line)["bookno"] for line in f]
+    return sorted(booknos, key=int)
+
+
+def test_shard_of_is_deterministic():
+    assert export.shard_of("12", 16) == export.shard_of(12, 16)
+    assert [export.shard_of(str(n), 4) for n in range(8)] == [
+        export.shard_of(str(n), 4) for n in range(8)
+    ]
+    assert {export.shard_of(str(n), 4) for n in range(100)} == {0, 1, 2, 3}
+
+
+def test_export_and_read_back(home):
+    add_books(home, range(20))
+    add_books(home, range(20, 30), subdir="a-c")  # tossed by toss.py
+
+    assert export.export_library(n_shards=4, workers=2) == 30
+
+    outputdir = home / constants.EXPORT_FOLDER
+    assert exported_booknos(outputdir) == [str(n) for n in range(30)]
+    for n in range(30):
+        shard = export.shard_of(str(n), 4)
+        book = export.read_book(str(n), n_shards=4)
+        assert book["title"] == f"Title {n}"
+        assert book["text"] == book_text(n)
+        index = export.index_fpath(outputdir, shard, 0).read_text()
+        assert f'"bookno": "{n}"' in index
+    assert export.read_book(7, n_shards=4)["text"] == book_text(7)
+    assert export.read_book("1000", n_shards=4) is None
+
+
+def test_parts_are_rolled_over(home):
+    add_books(home, range(12))
+    export.export_library(n_shards=2, workers=2, part_bytes=200)
+
+    outputdir = home / constants.EXPORT_FOLDER
+    for shard in range(2):
+        parts = export.shard_parts(outputdir, shard)
+        assert len(parts) > 1
+        for part in parts[:-1]:
+            assert os.path.getsize(export.part_fpath(outputdir, shard, part)) >= 200
+    assert exported_booknos(outputdir) == [str(n) for n in range(12)]
+    assert export.read_book("11", n_shards=2)["text"] == book_text(11)
+
+
+def test_resume_after_interruption(home):
+    add_books(home, range(20))
+    export.export_library(n_shards=2, workers=2)
+
+    # Interrupted in the middle of a book, and in the middle of an index line.
+    outputdir = home / constants.EXPORT_FOLDER
+    part = export.part_fpath(outputdir, 0, 0)
+    os.truncate(part, os.path.getsize(part) - 10)
+    with open(export.index_fpath(outputdir, 1, 0), "ab") as f:
+        f.write(b'{"bookno": "9')
+
+    assert export.export_library(n_shards=2, workers=2) == 1
+    assert exported_booknos(outputdir) == [str(n) for n in range(20)]
+    for n in range(20):
+        assert export.read_book(str(n), n_shards=2)["text"] == book_text(n)
+
+
+def test_resume_after_library_grows(home):
+    add_books(home, range(20))
+    export.export_library(n_shards=4, workers=2)
+    add_books(home, range(20, 25))
+
+    assert export.export_library(n_shards=4, workers=2) == 5
+    assert export.read_book("22", n_shards=4)["text"] == book_text(22)
+    assert exported_booknos(home / constants.EXPORT_FOLDER) == [
+        str(n) for n in range(25)
+    ]
+
+
+def test_restart_with_another_number_of_shards(home):
+    add_books(home, range(20))
+    export.export_library(n_shards=4, workers=2)
+
+    with pytest.raises(ValueError):
+        export.export_library(n_shards=2, workers=2)
+
+    assert export.export_library(n_shards=2, workers=2, restart=True) == 20
+    outputdir = home / constants.EXPORT_FOLDER
+    assert not glob.glob(str(outputdir / "shard-00002-*"))
+    assert not glob.glob(str(outputdir / "shard-00003-*"))
+    assert exported_booknos(outputdir) == [str(n) for n in range(20)]
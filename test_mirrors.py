@@ -0,0 +1,291 @@
+import http.client
+import socket
+import threading
+import time
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import bulkdownload
+import constants
+from mirrors import MirrorPool
+
+
+class StandIn:
+    """A local HTTP server standing in for a Gutenberg mirror.
+    Serves BODY for every path, unless told to be slow, to fail, or that a file is missing.
+    The "short" mode drops the connection halfway through a declared Content-Length,
+    the "chunked" mode halfway through a chunked response."""
+
+    BODY = b"x" * 10000
+
+    def __init__(
+        self,
+        delay: float = 0.0,
+        status: int = 200,
+        files: list = None,
+        mode: str = None,
+    ):
+        self.delay = delay
+        self.status = status
+        self.files = files  # None means every file exists
+        self.mode = mode
+        self.hits = []
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.lstrip("/")
+                standin.hits.append(path)
+                time.sleep(standin.delay)
+                if standin.status != 200:
+                    self.send_error(standin.status)
+                    return
+                if standin.files is not None and path not in standin.files:
+                    self.send_error(404)
+                    return
+                if standin.mode == "chunked":
+                    self.protocol_version = "HTTP/1.1"
+                    self.close_connection = True
+                    self.send_response(200)
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.end_headers()
+                    self.wfile.write(b"%x\r\n" % 100 + standin.BODY[:100] + b"\r\n")
+                    self.wfile.write(b"%x\r\n" % 1000 + standin.BODY[:10])
+                    return
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(standin.BODY)))
+                self.end_headers()
+                if standin.mode == "short":
+                    self.wfile.write(standin.BODY[:100])
+                    return
+                self.wfile.write(standin.BODY)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def downloads(self) -> list:
+        return [p for p in self.hits if p != constants.MIRROR_PROBE_PATH]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeTime:
+    """Real clock, but sleeping only moves it forward, so backoffs and cooldowns are instant."""
+
+    def __init__(self):
+        self.offset = 0.0
+        self.sleeps = []
+
+    def clock(self) -> float:
+        return time.monotonic() + self.offset
+
+    def sleep(self, delay: float):
+        self.sleeps.append(delay)
+        self.offset += delay
+
+
+@pytest.fixture
+def standin():
+    servers = []
+
+    def make(**kwargs) -> StandIn:
+        server = StandIn(**kwargs)
+        servers.append(server)
+        return server
+
+    yield make
+    for server in servers:
+        server.close()
+
+
+@pytest.fixture
+def faketime():
+    return FakeTime()
+
+
+def dead_url() -> str:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    return f"http://127.0.0.1:{port}/"
+
+
+def make_pool(mirrors: list, faketime: FakeTime, **kwargs) -> MirrorPool:
+    kwargs.setdefault("timeout", 5)
+    return MirrorPool(mirrors, sleep=faketime.sleep, clock=faketime.clock, **kwargs)
+
+
+def test_fastest_mirror_is_used(standin, faketime, tmp_path):
+    slow = standin(delay=0.3)
+    fast = standin()
+    pool = make_pool([slow.url, fast.url], faketime)
+    pool.urlretrieve("1/2/12.zip", tmp_path / "12.zip")
+
+    assert (tmp_path / "12.zip").read_bytes() == StandIn.BODY
+    assert fast.downloads() == ["1/2/12.zip"]
+    assert slow.downloads() == []
+    assert [s.url for s in pool.ranked()] == [fast.url, slow.url]
+
+
+def test_failing_and_dead_mirrors_fail_over(standin, faketime, tmp_path):
+    broken = standin(status=503)
+    good = standin(delay=0.2)
+    pool = make_pool([dead_url(), broken.url, good.url], faketime)
+    pool.urlretrieve("12.zip", tmp_path / "12.zip")
+
+    assert (tmp_path / "12.zip").read_bytes() == StandIn.BODY
+    assert faketime.sleeps == []
+    report = {r["url"]: r for r in pool.report()}
+    assert report[good.url]["successes"] == 1
+    assert report[good.url]["bytes_downloaded"] == len(StandIn.BODY)
+    assert report[good.url]["probes"] == 1
+    assert report[broken.url]["probe_failures"] == 1
+
+
+def test_backoff_when_all_mirrors_fail(standin, faketime, tmp_path):
+    a = standin(status=500)
+    b = standin(status=503)
+    pool = make_pool([a.url, b.url], faketime, retries=4, backoff=2.0, max_failures=100)
+
+    with pytest.raises(urllib.error.HTTPError) as e:
+        pool.urlretrieve("12.zip", tmp_path / "12.zip")
+    assert e.value.code in (500, 503)
+    assert faketime.sleeps == [2.0, 4.0, 8.0]
+    assert len(a.downloads()) == 4
+    assert not (tmp_path / "12.zip").exists()
+    assert not (tmp_path / "12.zip.part").exists()
+
+
+def test_dead_mirror_raises_after_retries(faketime, tmp_path):
+    pool = make_pool([dead_url()], faketime, retries=2, backoff=1.0, max_failures=100)
+    with pytest.raises(urllib.error.URLError):
+        pool.urlretrieve("12.zip", tmp_path / "12.zip")
+    assert faketime.sleeps == [1.0]
+
+
+def test_bench_after_max_failures_and_unbench_after_cooldown(
+    standin, faketime, tmp_path
+):
+    bad = standin(status=500)
+    good = standin(files=[constants.MIRROR_PROBE_PATH])
+    pool = make_pool([bad.url, good.url], faketime, max_failures=2, cooldown=60)
+
+    # The probe and the download both fail on the bad mirror: it gets benched.
+    with pytest.raises(urllib.error.HTTPError):
+        pool.urlretrieve("12.zip", tmp_path / "12.zip")
+    assert [s.url for s in pool.ranked()] == [good.url]
+
+    # A benched mirror isn't asked.
+    with pytest.raises(urllib.error.HTTPError):
+        pool.urlretrieve("13.zip", tmp_path / "13.zip")
+    assert bad.downloads() == ["12.zip"]
+
+    faketime.sleep(60)
+    assert bad.url in [s.url for s in pool.ranked()]
+
+    # Back in business, a success clears the failures.
+    bad.status = 200
+    pool.urlretrieve("14.zip", tmp_path / "14.zip")
+    assert bad.downloads() == ["12.zip", "14.zip"]
+    assert pool.stats[bad.url].consecutive_failures == 0
+
+
+def test_short_body_is_a_failure(standin, faketime, tmp_path):
+    short = standin(mode="short")
+    good = standin(delay=0.2)
+    pool = make_pool([short.url, good.url], faketime, max_failures=100)
+    pool.probe_all()
+    # Make sure the short mirror is asked first.
+    pool.stats[short.url].latency = 0.0
+
+    pool.urlretrieve("12.zip", tmp_path / "12.zip")
+    assert short.downloads() == ["12.zip"]
+    assert (tmp_path / "12.zip").read_bytes() == StandIn.BODY
+    assert pool.stats[short.url].failures == 1
+    assert pool.stats[short.url].successes == 0
+
+    alone = make_pool([short.url], faketime, retries=2, max_failures=100)
+    with pytest.raises(urllib.error.ContentTooShortError):
+        alone.urlretrieve("13.zip", tmp_path / "13.zip")
+    assert not (tmp_path / "13.zip").exists()
+    assert not (tmp_path / "13.zip.part").exists()
+
+
+def test_broken_chunked_response_is_a_failure(standin, faketime, tmp_path):
+    chunked = standin(mode="chunked")
+    pool = make_pool([chunked.url], faketime, retries=2, max_failures=100)
+    with pytest.raises(http.client.HTTPException):
+        pool.urlretrieve("12.zip", tmp_path / "12.zip")
+    assert faketime.sleeps == [constants.MIRROR_BACKOFF]
+    assert pool.stats[chunked.url].probe_failures == 1
+    assert pool.stats[chunked.url].failures == 2
+    assert not (tmp_path / "12.zip").exists()
+
+    good = standin()
+    pool = make_pool([chunked.url, good.url], faketime)
+    pool.urlretrieve("12.zip", tmp_path / "12.zip")
+    assert (tmp_path / "12.zip").read_bytes() == StandIn.BODY
+
+
+def test_benched_mirrors_are_not_probed(standin, faketime):
+    mirror = standin()
+    pool = make_pool([mirror.url], faketime, cooldown=60)
+    pool.stats[mirror.url].benched_until = faketime.clock() + 60
+    pool.probe_all()
+    assert mirror.hits == []
+    assert pool.ranked() == []
+
+
+def test_404_on_all_mirrors_raises_http_error(standin, faketime, tmp_path):
+    a = standin(files=[constants.MIRROR_PROBE_PATH])
+    b = standin(files=[constants.MIRROR_PROBE_PATH])
+    pool = make_pool([a.url, b.url], faketime)
+
+    with pytest.raises(urllib.error.HTTPError) as e:
+        pool.urlretrieve("12.zip", tmp_path / "12.zip")
+    assert e.value.code == 404
+    assert faketime.sleeps == []
+    assert a.downloads() == b.downloads() == ["12.zip"]
+    assert not (tmp_path / "12.zip").exists()
+    assert not (tmp_path / "12.zip.part").exists()
+
+
+def test_404_wins_over_failing_mirror(standin, faketime, tmp_path):
+    missing = standin(files=[constants.MIRROR_PROBE_PATH])
+    broken = standin(status=500)
+    pool = make_pool([missing.url, broken.url], faketime, retries=4, max_failures=10)
+
+    with pytest.raises(urllib.error.HTTPError) as e:
+        pool.urlretrieve("12.zip", tmp_path / "12.zip")
+    assert e.value.code == 404
+    assert faketime.sleeps == []
+
+
+def test_retries_must_be_positive():
+    with pytest.raises(ValueError):
+        MirrorPool(["http://127.0.0.1/"], retries=0)
+    with pytest.raises(ValueError):
+        MirrorPool([])
+
+
+def test_urlretrieve_try_alt_finds_alternative_filename(
+    standin, faketime, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(constants, "HOME", tmp_path)
+    (tmp_path / constants.ZIPPED_FOLDER).mkdir()
+    missing = standin(files=[constants.MIRROR_PROBE_PATH])
+    mirror = standin(files=[constants.MIRROR_PROBE_PATH, "1/2/12-8.txt"])
+    broken = standin(status=500)
+    pool = make_pool([missing.url, mirror.url, broken.url], faketime, max_failures=10)
+
+    bulkdownload.urlretrieve_try_alt(pool, "1/2/12-8.zip", "12-8.zip")
+
+    zipped = tmp_path / constants.ZIPPED_FOLDER
+    assert (zipped / "12-8.txt").read_bytes() == StandIn.BODY
+    assert not (zipped / "12-8.zip").exists()
@@ -46,13 +46,20 @@ def load_manifest() -> tuple[dict, dict, dict, dict]:
         return None
 
 
+def iter_ebooks():
+    """Yield (fpath, info) for every book in the library, one at a time.
+    Only the json header line of each book is read.
+    Books tossed into subdirectories by toss.py are included."""
+    for dirpath, _, filenames in os.walk(Path(constants.HOME, constants.EBOOKS_FOLDER)):
+        for ebook in filenames:
+            fpath = Path(dirpath, ebook)
+            with io.open(fpath, "r", encoding="utf8") as f:
+                info = json.loads(f.readline())
+            yield fpath, info
+
+
 def get_ebooks_library() -> dict:
-    ebooks = os.listdir(Path(constants.HOME, constants.EBOOKS_FOLDER))
     library = {}
-    for ebook in ebooks:
-        with io.open(
-            Path(constants.HOME, constants.EBOOKS_FOLDER, ebook), "r", encoding="utf8"
-        ) as f:
-            info = json.loads(f.readline())
-            library[info["bookno"]] = info
+    for _, info in iter_ebooks():
+        library[info["bookno"]] = info
     return library